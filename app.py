@@ -1,9 +1,9 @@
 import streamlit as st
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
 from PIL import Image
 import io
+import hashlib
 
 # Configuración de la página
 st.set_page_config(
@@ -15,32 +15,193 @@ st.set_page_config(
 st.title("🔍 Vision - Procesamiento de Imágenes")
 st.markdown("---")
 
-# Función para cargar imagen
-def load_image(image_file):
-    img = Image.open(image_file)
-    return np.array(img)
+# Tiempo de vida de los resultados en caché (24 h)
+CACHE_TTL = 24 * 60 * 60
 
-# Función para procesar imagen
-def process_image(img, band, binarize_otsu, global_bins):
+# Número máximo de resultados guardados por función cacheada: cada entrada puede
+# ser una imagen completa, así que la memoria del servidor queda acotada
+CACHE_MAX_ENTRIES = 16
+
+# Lado máximo (en píxeles) de las imágenes que se envían al navegador
+PREVIEW_MAX_SIDE = 2000
+
+# Función para calcular la clave de caché de un array derivado a partir de todo
+# su contenido (Streamlit solo muestrea 100k elementos en arrays grandes, lo que
+# confunde imágenes del mismo tamaño que difieren en pocos píxeles)
+def _hash_array(arr):
+    digest = hashlib.sha1(np.ascontiguousarray(arr).data).hexdigest()
+    return arr.shape, arr.dtype.str, digest
+
+ARRAY_HASH_FUNCS = {np.ndarray: _hash_array}
+
+# Función para cargar imagen (cacheada por el resumen del archivo subido)
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def load_image(file_hash, _file_bytes):
+    img = Image.open(io.BytesIO(_file_bytes))
+    img.load()
+    # np.asarray evita una segunda copia del buffer decodificado
+    # (el array resultante es de solo lectura; no se modifica en sitio)
+    return np.asarray(img)
+
+# Función para contar píxeles por nivel de intensidad (compartida por Otsu,
+# histograma y estadísticas)
+def pixel_counts(img):
+    return np.bincount(img.ravel(), minlength=256)
+
+# Función para calcular el umbral de Otsu a partir del conteo de 256 niveles
+def otsu_threshold(counts):
+    p = counts / counts.sum()
+    omega = np.cumsum(p)
+    mu = np.cumsum(p * np.arange(256))
+    mu_t = mu[-1]
+    # Varianza entre clases para cada umbral posible, calculada de forma vectorizada
+    sigma_b2 = (mu_t * omega - mu) ** 2 / (omega * (1 - omega) + 1e-12)
+    return int(np.argmax(sigma_b2))
+
+# Función para llevar una banda de cualquier tipo al rango uint8 [0, 255]
+def normalize_band(band):
+    mn, mx = band.min(), band.max()
+    scale = 255.0 / max(float(mx) - float(mn), 1e-12)
+    # Resta y escalado en sitio sobre una única copia float32
+    out = band.astype(np.float32)
+    out -= mn
+    out *= scale
+    # Redondeo al entero más cercano antes del truncado de astype
+    out += 0.5
+    return out.astype(np.uint8)
+
+# Función para reducir una imagen al tamaño de visualización
+def resize_for_display(img, max_side=PREVIEW_MAX_SIDE, interpolation=cv2.INTER_AREA):
+    h, w = img.shape[:2]
+    scale = max_side / max(h, w)
+    if scale >= 1:
+        return img
+    if img.dtype in (np.uint8, np.uint16, np.int16, np.float32, np.float64):
+        size = (max(int(w * scale), 1), max(int(h * scale), 1))
+        return cv2.resize(img, size, interpolation=interpolation)
+    # Tipos que cv2.resize no admite (bool, int32): submuestreo simple
+    step = int(np.ceil(1 / scale))
+    return img[::step, ::step]
+
+# Función para obtener la vista previa cacheada de una imagen (image_key
+# identifica la imagen sin tener que recorrerla para calcular la clave)
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def make_preview(image_key, _img, max_side=PREVIEW_MAX_SIDE, interpolation=cv2.INTER_AREA):
+    return resize_for_display(_img, max_side, interpolation)
+
+# Función para cargar la imagen original ya reducida para visualización.
+# Solo compensa en JPEG con reducción de al menos 1/2, donde el decodificador
+# trabaja directamente a escala reducida; en otro caso devuelve None y se
+# reduce la imagen ya decodificada
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def load_preview(file_hash, _file_bytes, max_side=PREVIEW_MAX_SIDE):
+    img = Image.open(io.BytesIO(_file_bytes))
+    w, h = img.size
+    scale = max_side / max(w, h)
+    if img.format != 'JPEG' or scale > 0.5:
+        return None
+    img.draft(img.mode, (int(np.ceil(w * scale)), int(np.ceil(h * scale))))
+    img.load()
+    return resize_for_display(np.asarray(img), max_side)
+
+# Función para procesar imagen (la imagen original se identifica por file_hash)
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def process_image(file_hash, _img, band, binarize_otsu):
     # Convertir a escala de grises si es necesario
-    if len(img.shape) == 3:
-        if band == 1:
-            processed_img = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+    if len(_img.shape) == 3:
+        if band == 1 and _img.shape[2] in (3, 4):
+            # cv2.cvtColor ignora el canal alfa en RGBA
+            code = cv2.COLOR_RGBA2GRAY if _img.shape[2] == 4 else cv2.COLOR_RGB2GRAY
+            processed_img = cv2.cvtColor(_img, code)
         else:
-            processed_img = img[:, :, band-1]  # Seleccionar banda específica
+            processed_img = _img[:, :, band-1]  # Seleccionar banda específica
     else:
-        processed_img = img
+        processed_img = _img
+    
+    # Normalizar bandas que no son de 8 bits (16 bits, enteros de 32 bits, flotantes)
+    if processed_img.dtype != np.uint8:
+        processed_img = normalize_band(processed_img)
+    
+    # La banda seleccionada es una vista con saltos entre canales; se copia una
+    # sola vez a memoria contigua para que el conteo de niveles y el umbralizado
+    # recorran datos consecutivos (no-op si ya es contigua)
+    processed_img = np.ascontiguousarray(processed_img)
+    
+    # Único recorrido de la imagen para contar niveles
+    counts = pixel_counts(processed_img)
     
     # Aplicar binarización Otsu si está activada
+    thresh = None
     if binarize_otsu:
-        _, processed_img = cv2.threshold(processed_img, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        thresh = otsu_threshold(counts)
+        # Umbralizado en una sola pasada que escribe directamente en uint8
+        _, processed_img = cv2.threshold(processed_img, thresh, 255, cv2.THRESH_BINARY)
+        # El conteo de la imagen binaria se deduce del de la banda
+        binary_counts = np.zeros_like(counts)
+        binary_counts[0] = counts[:thresh + 1].sum()
+        binary_counts[255] = counts[thresh + 1:].sum()
+        counts = binary_counts
     
-    return processed_img
+    return processed_img, counts, thresh
 
 # Función para generar histograma
-def generate_histogram(img, bins):
-    hist, bin_edges = np.histogram(img.flatten(), bins=bins, range=(0, 256))
-    return hist, bin_edges
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False,
+               hash_funcs=ARRAY_HASH_FUNCS)
+def generate_histogram(counts, bins):
+    # Ruta rápida: un número de bins que divide 256 agrupa niveles consecutivos
+    if 256 % bins == 0:
+        if bins == 256:
+            return counts, np.arange(257)
+        step = 256 // bins
+        return counts.reshape(bins, step).sum(axis=1), np.linspace(0, 256, bins + 1)
+    # Resto de casos: histograma de los 256 niveles ponderado por su conteo
+    hist, bin_edges = np.histogram(np.arange(256), bins=bins, range=(0, 256), weights=counts)
+    return hist.astype(counts.dtype), bin_edges
+
+# Función para dibujar el histograma (devuelve el PNG ya rasterizado)
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False,
+               hash_funcs=ARRAY_HASH_FUNCS)
+def render_histogram(hist, bin_edges, bins):
+    # Importación diferida: matplotlib solo se carga al dibujar el primer histograma
+    import matplotlib.pyplot as plt
+    
+    fig, ax = plt.subplots(figsize=(12, 6))
+    ax.bar(bin_edges[:-1], hist, width=np.diff(bin_edges), alpha=0.7, color='steelblue', edgecolor='black')
+    ax.set_xlabel('Intensidad de píxel')
+    ax.set_ylabel('Frecuencia')
+    ax.set_title(f'Histograma - {bins} bins')
+    ax.grid(True, alpha=0.3)
+    
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', bbox_inches='tight')
+    plt.close(fig)
+    return buffer.getvalue()
+
+# Función para codificar la imagen procesada como PNG
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def make_png(image_key, _img):
+    # Nivel de compresión 1: mucho más rápido que el nivel por defecto
+    # a cambio de un archivo algo mayor
+    _, buffer = cv2.imencode('.png', _img, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+    return buffer.tobytes()
+
+# Función para calcular estadísticas
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False,
+               hash_funcs=ARRAY_HASH_FUNCS)
+def calculate_statistics(counts):
+    # Todas las estadísticas salen del conteo de 256 niveles,
+    # sin volver a recorrer la imagen
+    values = np.arange(256)
+    total = counts.sum()
+    mean = (counts * values).sum() / total
+    var = (counts * (values - mean) ** 2).sum() / total
+    nonzero = np.flatnonzero(counts)
+    return {
+        "max": int(nonzero[-1]),
+        "min": int(nonzero[0]),
+        "mean": mean,
+        "std": np.sqrt(var),
+    }
 
 # Sidebar para controles
 st.sidebar.header("⚙️ Controles")
@@ -53,48 +214,62 @@ uploaded_file = st.sidebar.file_uploader(
 )
 
 if uploaded_file is not None:
-    # Cargar imagen
-    original_img = load_image(uploaded_file)
-    
-    # Controles interactivos
-    st.sidebar.markdown("### 🎛️ Parámetros de procesamiento")
-    
-    # Slider para selección de banda
-    max_bands = 1 if len(original_img.shape) == 2 else original_img.shape[2]
-    band = st.sidebar.slider(
-        "Banda",
-        min_value=1,
-        max_value=max(max_bands, 1),
-        value=1,
-        help="Selecciona la banda a procesar"
-    )
-    
-    # Checkbox para binarización Otsu
-    binarize_otsu = st.sidebar.checkbox(
-        "Binarizar (Otsu)",
-        value=False,
-        help="Aplica binarización automática usando el método de Otsu"
-    )
+    # Cargar imagen (el resumen de los bytes del archivo es la clave de la caché)
+    file_bytes = uploaded_file.getvalue()
+    file_hash = hashlib.sha1(file_bytes).hexdigest()
+    original_img = load_image(file_hash, file_bytes)
     
-    # Slider para bins del histograma
-    global_bins = st.sidebar.slider(
-        "Bins global",
-        min_value=32,
-        max_value=1024,
-        value=256,
-        step=32,
-        help="Número de bins para el histograma"
-    )
+    # Controles interactivos: agrupados en un formulario para que los cambios
+    # se apliquen juntos con un único rerun al pulsar "Aplicar"
+    with st.sidebar.form("parametros"):
+        st.markdown("### 🎛️ Parámetros de procesamiento")
+        
+        # Slider para selección de banda (solo si la imagen tiene varias bandas)
+        max_bands = 1 if len(original_img.shape) == 2 else original_img.shape[2]
+        if max_bands > 1:
+            band = st.slider(
+                "Banda",
+                min_value=1,
+                max_value=max_bands,
+                value=1,
+                help="Selecciona la banda a procesar"
+            )
+        else:
+            band = 1
+        
+        # Checkbox para binarización Otsu
+        binarize_otsu = st.checkbox(
+            "Binarizar (Otsu)",
+            value=False,
+            help="Aplica binarización automática usando el método de Otsu"
+        )
+        
+        # Slider para bins del histograma
+        global_bins = st.slider(
+            "Bins global",
+            min_value=32,
+            max_value=1024,
+            value=256,
+            step=32,
+            help="Número de bins para el histograma"
+        )
+        
+        st.form_submit_button("Aplicar")
     
     # Procesar imagen
-    processed_img = process_image(original_img, band, binarize_otsu, global_bins)
+    processed_img, counts, thresh = process_image(file_hash, original_img, band, binarize_otsu)
+    # Clave de caché de la imagen procesada: archivo de origen y parámetros
+    processed_key = (file_hash, band, binarize_otsu)
     
     # Layout de columnas
     col1, col2 = st.columns(2)
     
     with col1:
         st.subheader("📷 Imagen Original")
-        st.image(original_img, caption=f"Archivo: {uploaded_file.name}", use_container_width=True)
+        original_preview = load_preview(file_hash, file_bytes)
+        if original_preview is None:
+            original_preview = make_preview(file_hash, original_img)
+        st.image(original_preview, caption=f"Archivo: {uploaded_file.name}", width="stretch")
         
         # Información de la imagen
         st.info(f"""
@@ -110,63 +285,52 @@ if uploaded_file is not None:
         
         # Mostrar imagen procesada
         if binarize_otsu:
-            st.image(processed_img, caption="Imagen binarizada (Otsu)", use_container_width=True, clamp=True)
+            # Vecino más cercano para que la vista previa siga siendo binaria (0/255)
+            preview = make_preview(processed_key, processed_img, interpolation=cv2.INTER_NEAREST)
+            st.image(preview, caption=f"Imagen binarizada (Otsu, umbral = {thresh})", width="stretch", clamp=True)
         else:
-            st.image(processed_img, caption=f"Banda {band}", use_container_width=True, clamp=True)
+            st.image(make_preview(processed_key, processed_img), caption=f"Banda {band}", width="stretch", clamp=True)
     
     # Histograma
     st.markdown("---")
     st.subheader("📊 Análisis del Histograma")
     
     # Generar histograma
-    hist, bin_edges = generate_histogram(processed_img, global_bins)
-    
-    # Crear gráfico del histograma
-    fig, ax = plt.subplots(figsize=(12, 6))
-    ax.bar(bin_edges[:-1], hist, width=np.diff(bin_edges), alpha=0.7, color='steelblue', edgecolor='black')
-    ax.set_xlabel('Intensidad de píxel')
-    ax.set_ylabel('Frecuencia')
-    ax.set_title(f'Histograma - {global_bins} bins')
-    ax.grid(True, alpha=0.3)
+    hist, bin_edges = generate_histogram(counts, global_bins)
     
-    st.pyplot(fig)
+    # Mostrar gráfico del histograma
+    st.image(render_histogram(hist, bin_edges, global_bins), width="stretch")
     
     # Estadísticas
+    stats = calculate_statistics(counts)
     col3, col4, col5, col6 = st.columns(4)
     
     with col3:
-        st.metric("📈 Valor máximo", f"{np.max(processed_img)}")
+        st.metric("📈 Valor máximo", f"{stats['max']}")
     with col4:
-        st.metric("📉 Valor mínimo", f"{np.min(processed_img)}")
+        st.metric("📉 Valor mínimo", f"{stats['min']}")
     with col5:
-        st.metric("📊 Media", f"{np.mean(processed_img):.2f}")
+        st.metric("📊 Media", f"{stats['mean']:.2f}")
     with col6:
-        st.metric("📏 Desv. Estándar", f"{np.std(processed_img):.2f}")
+        st.metric("📏 Desv. Estándar", f"{stats['std']:.2f}")
     
     # Descargar imagen procesada
     st.markdown("---")
     st.subheader("💾 Descarga")
     
-    if st.button("Descargar imagen procesada"):
-        # Convertir a PIL Image para descarga
-        if processed_img.dtype != np.uint8:
-            download_img = (processed_img * 255).astype(np.uint8)
-        else:
-            download_img = processed_img
-            
-        pil_img = Image.fromarray(download_img)
-        
-        # Crear buffer
-        img_buffer = io.BytesIO()
-        pil_img.save(img_buffer, format='PNG')
-        img_buffer.seek(0)
-        
-        st.download_button(
-            label="📥 Descargar PNG",
-            data=img_buffer,
-            file_name=f"processed_{uploaded_file.name.split('.')[0]}.png",
-            mime="image/png"
-        )
+    # Convertir a uint8 para descarga (reescalado por rango, no multiplicando por 255)
+    if processed_img.dtype != np.uint8:
+        download_img = normalize_band(processed_img)
+    else:
+        download_img = processed_img
+    
+    st.download_button(
+        label="📥 Descargar PNG",
+        # Datos diferidos: el PNG solo se codifica al pulsar el botón
+        data=lambda: make_png(processed_key, download_img),
+        file_name=f"processed_{uploaded_file.name.split('.')[0]}.png",
+        mime="image/png"
+    )
 
 else:
     # Mensaje cuando no hay imagen